@@ -2,48 +2,98 @@
 
 import streamlit as st # For building web apps requests 
 import os # For environment variable management requests
+import asyncio # For running Gemini calls concurrently
+import queue # For handing streamed text back to the script thread
+import re # For splitting documents into chunks
+import hashlib # For hashing document content into cache keys
+import time # For tracking cache expiry
+import threading # For guarding the shared response cache
+import numpy as np # For embedding vector math
 from typing import Optional # For type hinting
-from io import BytesIO # For handling byte streams
 from google import genai # Google Gemini API client library
 from google.genai.errors import APIError # For handling API errors
 from dotenv import load_dotenv # For loading environment variables from .env file
 
-try:
-    from PyPDF2 import PdfReader
+# Parse an uploaded document into text. Cached on the document id so Streamlit reruns don't re-parse (or re-hash) the same upload.
+# The parsers read the upload's file object directly rather than a bytes copy wrapped in a new BytesIO.
+# PDF and DOCX libraries are imported here, on first use, so text-only sessions never load them
+@st.cache_data(show_spinner=False)
+def _parse_document(doc_id: str, file_extension: str, _file) -> str:
+    _file.seek(0)
+    if file_extension in ['.txt', '.md']:
+        return _file.read().decode('utf-8', errors='replace') # A stray non-UTF-8 byte becomes U+FFFD instead of failing the whole upload
 
-except ImportError:
-    PdfReader=None
-try:
-    from docx import Document
+    elif file_extension == '.pdf':
+        try:
+            import pymupdf # PyMuPDF, preferred PDF backend
+
+        except ImportError:
+            pymupdf=None
+        if pymupdf:
+            # Pages are extracted sequentially on purpose: PyMuPDF shares one MuPDF context per process and is not thread-safe
+            doc=pymupdf.open(stream=_file.getvalue(), filetype="pdf") # Bytes, not the upload: PyMuPDF < 1.25.5 rejects BytesIO subclasses
+            text="\n".join(page.get_text("text") for page in doc) # MuPDF extracts in C, much faster than PyPDF2
+            doc.close()
+            return text
+
+        try:
+            from PyPDF2 import PdfReader
 
-except ImportError:
-    Document=None
+        except ImportError:
+            st.error("PDF reading functionality is not available. Please install the required library.")
+            return f"PDF reading functionality is not available. Please install the required library."
+        reader=PdfReader(_file)
+        parts=[]
+        for page in reader.pages:
+            parts.append(page.extract_text() or "") # Extract text from each page
+        return "".join(parts) # Join once instead of growing a string per page
+
+    elif file_extension == '.docx':
+        try:
+            from docx import Document
+            from docx.oxml.ns import qn
+
+        except ImportError:
+            st.error("DOCX reading functionality is not available. Please install the required library.")
+            return f"DOCX reading functionality is not available. Please install the required library."
+        doc=Document(_file)
+        # Walk the XML once instead of building Paragraph/Run wrappers; also picks up paragraphs inside tables and text boxes.
+        # Only a paragraph's own runs are read, like Paragraph.text: text-box paragraphs nested in a run are output as their own lines,
+        # and the copy Word saves under mc:Fallback for older readers is skipped
+        body=doc.element.body
+        text_tag=qn('w:t')
+        run_tag=qn('w:r')
+        break_tag=qn('w:br')
+        break_type=qn('w:type')
+        run_containers={qn('w:hyperlink'), qn('w:ins')}
+        separators={qn('w:tab'): "\t", qn('w:ptab'): "\t", qn('w:cr'): "\n", qn('w:noBreakHyphen'): "-"}
+        fallback_paragraphs=set()
+        for fallback in body.iter('{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback'):
+            fallback_paragraphs.update(fallback.iter(qn('w:p')))
+        lines=[]
+        for paragraph in body.iter(qn('w:p')):
+            if paragraph in fallback_paragraphs:
+                continue
+            parts=[]
+            for child in paragraph:
+                runs=[child] if child.tag == run_tag else child.findall(run_tag) if child.tag in run_containers else ()
+                for run in runs:
+                    for node in run:
+                        if node.tag == text_tag:
+                            parts.append(node.text or "")
+                        elif node.tag == break_tag:
+                            parts.append("\n" if node.get(break_type, "textWrapping") == "textWrapping" else "") # Page and column breaks add no text, as in python-docx
+                        else:
+                            parts.append(separators.get(node.tag, ""))
+            lines.append("".join(parts))
+        return "\n".join(lines)
 
 # Function to read content from uploaded document
-def read_document_content(uploaded_file):
+def read_document_content(uploaded_file, doc_id):
     file_extension=os.path.splitext(uploaded_file.name)[1].lower()
 
     try:
-        if file_extension in ['.txt', '.md']:
-            return uploaded_file.read().decode('utf-8')
-        
-        elif file_extension == '.pdf':
-            if not PdfReader:
-                st.error("PDF reading functionality is not available. Please install the required library.")
-                return f"PDF reading functionality is not available. Please install the required library."
-            reader=PdfReader(uploaded_file)
-            text=""
-            for page in reader.pages:
-                text+=page.extract_text() or "" # Extract text from each page
-            return text
-
-        elif file_extension == '.docx':
-            if not Document:
-                st.error("DOCX reading functionality is not available. Please install the required library.")
-                return f"DOCX reading functionality is not available. Please install the required library."
-            doc=Document(BytesIO(uploaded_file.getvalue()))
-            text="\n".join([paragraph.text for paragraph in doc.paragraphs])
-            return text
+        return _parse_document(doc_id, file_extension, uploaded_file) # Exceptions are not cached, so failed parses retry on the next run
 
     except Exception as e:
         st.error(f"Error reading document: {e}")
@@ -55,25 +105,316 @@ load_dotenv()  # Load environment variables from .env file
 GEMINI_API_KEY=os.getenv("GEMINI_API_KEY")
 MODEL_NAME="gemini-2.5-flash-lite"
 
+EMBEDDING_MODEL="gemini-embedding-001"
+EMBEDDING_DIM=768
+EMBEDDING_BATCH_SIZE=100 # Maximum texts per embed_content request
+CHUNK_SIZE=400 # Words per retrieval chunk (roughly 512 tokens)
+CHUNK_OVERLAP=50 # Words shared between consecutive chunks
+TOP_K=5 # Chunks sent to the model per question
+HNSW_MIN_CHUNKS=10000 # From this many chunks on, retrieval uses an approximate HNSW index instead of scoring every chunk
+INDEX_CACHE_MAX_ENTRIES=16 # Documents whose chunk embeddings and HNSW index are kept in memory, shared by all sessions
+INDEX_CACHE_TTL=3600 # Seconds a document's embeddings and index stay in memory; the disk cache still has the embeddings
+EMBED_DEBOUNCE_SECONDS=0.4 # Minimum time between background embeddings of the question being typed
+SEMANTIC_CACHE_THRESHOLD=0.95 # Minimum cosine similarity for a paraphrased question to reuse a cached answer
+CONTEXT_CACHE_TTL=3600 # Seconds a document stays in Gemini's context cache
+CONTEXT_CACHE_MIN_WORDS=800 # About Gemini's 1,024-token minimum for context caching; smaller documents are always sent whole
+RESPONSE_CACHE_TTL=3600 # Seconds an exact-match response stays cached
+DISK_CACHE_DIR=".rag_cache" # Chunk embeddings persisted here survive server restarts and are shared by every worker
+DISK_CACHE_SIZE_LIMIT=2**30 # Bytes; least recently stored entries are evicted beyond this
+NO_RESPONSE="No response received." # Shown when a reply is blocked or empty
+SYSTEM_INSTRUCTION="You are an AI assistant that answers questions based solely on the provided document content. If the answer is not present in the document, respond with 'The information is not available in the document.'"
+
+# One Gemini client per API key, shared across reruns and sessions so its HTTP connection pool is reused
+@st.cache_resource(show_spinner=False)
+def _get_client(api_key: Optional[str]) -> genai.Client:
+    return genai.Client(api_key=api_key)
+
+# Request configs built and validated once per process, not on every call or rerun
+@st.cache_resource(show_spinner=False)
+def _generation_config() -> genai.types.GenerateContentConfig:
+    return genai.types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION)
+
+@st.cache_resource(show_spinner=False)
+def _embedding_config() -> genai.types.EmbedContentConfig:
+    return genai.types.EmbedContentConfig(output_dimensionality=EMBEDDING_DIM)
+
+# Exact-match response cache shared across sessions: (model, doc_id, prompt, system_instruction) -> (expiry time, response).
+# A plain dict rather than st.cache_data, because responses are streamed and only stored once complete
+@st.cache_resource(show_spinner=False)
+def _response_cache():
+    return {}, threading.Lock()
+
+def _get_cached_response(key: tuple) -> Optional[str]:
+    cache, lock=_response_cache()
+    with lock:
+        entry=cache.get(key)
+    return entry[1] if entry and entry[0] > time.time() else None
+
+def _store_response(key: tuple, response: str):
+    cache, lock=_response_cache()
+    now=time.time()
+    with lock:
+        for expired in [k for k, (expires, _) in cache.items() if expires <= now]:
+            del cache[expired]
+        cache[key]=(now+RESPONSE_CACHE_TTL, response)
+
+# One event loop per process, running in a background thread. The shared client's async connections stay bound to this loop across reruns,
+# which a fresh asyncio.run() per rerun would break
+@st.cache_resource(show_spinner=False)
+def _event_loop() -> asyncio.AbstractEventLoop:
+    loop=asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="gemini-event-loop", daemon=True).start()
+    return loop
+
+# Run a coroutine on the background loop and wait for its result, drawing the latest text it streams into the placeholder.
+# Only the script thread may draw on the page, so the coroutine hands text over through a queue instead of touching the placeholder itself
+def run_streaming(make_coroutine, placeholder=None):
+    streamed=queue.Queue()
+    future=asyncio.run_coroutine_threadsafe(make_coroutine(streamed.put), _event_loop())
+    while not future.done() or not streamed.empty():
+        try:
+            text=streamed.get(timeout=0.05)
+            while not streamed.empty():
+                text=streamed.get_nowait() # Skip to the newest text if the stream got ahead of the page
+        except queue.Empty:
+            continue
+        if placeholder is not None:
+            placeholder.markdown(text)
+    return future.result()
+
 class GeminiAPI:
     def __init__(self, api_key: Optional[str]=None):
         self.api_key=api_key or GEMINI_API_KEY
     
-    def generate_response(self, model:str, content:list, system_instruction:str) -> str:
+    async def agenerate_response(self, model:str, content:str, system_instruction:str, doc_id:str, prompt:str, cached_content:Optional[str]=None, on_text=None) -> str:
+        # Streams the growing answer to the optional on_text callback and returns the full text. Errors are returned, never cached or shown:
+        # this runs off the script thread, so the caller reports them
+        key=(model, doc_id, prompt, system_instruction)
+        cached=_get_cached_response(key)
+        if cached is not None:
+            return cached
+
         try:
-            client=genai.Client(api_key=self.api_key)
-            config=genai.types.GenerateContentConfig(system_instruction=system_instruction)
-            response=client.models.generate_content(model=model, contents=content, config=config)
-            return response.text if response else "No response received."
+            client=_get_client(self.api_key)
+            if cached_content:
+                config=genai.types.GenerateContentConfig(cached_content=cached_content) # System instruction and document live in the cache
+            elif system_instruction == SYSTEM_INSTRUCTION:
+                config=_generation_config()
+            else:
+                config=genai.types.GenerateContentConfig(system_instruction=system_instruction)
+            response=""
+            async for chunk in await client.aio.models.generate_content_stream(model=model, contents=content, config=config):
+                response+=chunk.text or "" # text is None for blocked or empty chunks
+                if on_text is not None:
+                    on_text(response)
+            if not response:
+                return NO_RESPONSE # Not cached, so asking again makes a fresh call
+            _store_response(key, response)
+            return response
             
         except APIError as e:
-            st.error(f"API Error: {e}")
             return f"API Error: {e}"
         
         except Exception as e:
-            st.error(f"Unexpected Error: {e}")
             return f"Unexpected Error: {e}"
 
+    def batch_embed(self, texts:list, batch_size:int=EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        # Embed many texts with one request per batch; returns a contiguous (len(texts), EMBEDDING_DIM) float32 array of unit-length rows
+        client=_get_client(self.api_key)
+        values=[]
+        for start in range(0, len(texts), batch_size):
+            result=client.models.embed_content(model=EMBEDDING_MODEL, contents=texts[start:start+batch_size], config=_embedding_config())
+            values.extend(embedding.values for embedding in result.embeddings)
+        vectors=np.asarray(values, dtype=np.float32).reshape(len(texts), EMBEDDING_DIM)
+        return vectors/np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    async def aembed(self, text:str) -> Optional[np.ndarray]:
+        # Unit-length query embedding for the semantic cache and retrieval; None if embedding fails so answering can still proceed
+        try:
+            client=_get_client(self.api_key)
+            result=await client.aio.models.embed_content(model=EMBEDDING_MODEL, contents=[text], config=_embedding_config())
+            vector=np.asarray(result.embeddings[0].values, dtype=np.float32)
+            return vector/np.linalg.norm(vector)
+
+        except Exception:
+            return None
+
+    def create_context_cache(self, model:str, document:str, system_instruction:str) -> Optional[str]:
+        # Upload the document once so later questions reuse its prefill; None if the document is below the model's minimum cacheable size or caching fails
+        try:
+            client=_get_client(self.api_key)
+            config=genai.types.CreateCachedContentConfig(contents=[f"Document Content:\n{document}"], system_instruction=system_instruction, ttl=f"{CONTEXT_CACHE_TTL}s")
+            return client.caches.create(model=model, config=config).name
+
+        except Exception:
+            return None
+
+# Gemini context cache name for a document sent whole, shared by every session asking about it. Renewed a minute before Gemini expires it,
+# so in-flight questions don't hit an expired cache; the old one then expires on its own. None, cached too so it isn't retried on every
+# rerun, when the document is below Gemini's minimum cacheable size or caching fails
+@st.cache_resource(show_spinner=False, ttl=CONTEXT_CACHE_TTL-60)
+def _context_cache_name(doc_id: str, model: str, _document: str, _gemini_api: "GeminiAPI") -> Optional[str]:
+    if len(re.findall(r"\S+", _document)) < CONTEXT_CACHE_MIN_WORDS:
+        return None
+    return _gemini_api.create_context_cache(model, _document, SYSTEM_INSTRUCTION)
+
+# Empty the semantic cache; question embeddings are kept as one contiguous matrix so a lookup is a single matrix-vector product
+def reset_semantic_cache():
+    st.session_state.semantic_cache_vectors=np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    st.session_state.semantic_cache_responses=[]
+
+def semantic_cache_add(query_vector: np.ndarray, response: str):
+    st.session_state.semantic_cache_vectors=np.vstack([st.session_state.semantic_cache_vectors, query_vector])
+    st.session_state.semantic_cache_responses.append(response)
+
+# Return the cached answer of the most similar previous question on this document, if it is similar enough.
+# Takes the cache contents as arguments so it can run off the script thread
+def semantic_cache_lookup(query_vector: Optional[np.ndarray], vectors: np.ndarray, responses: list) -> Optional[str]:
+    if query_vector is None or not responses:
+        return None
+    scores=vectors @ query_vector
+    best=int(np.argmax(scores))
+    return responses[best] if scores[best] >= SEMANTIC_CACHE_THRESHOLD else None
+
+# Split text into overlapping chunks of about CHUNK_SIZE words, keeping the original whitespace inside each chunk
+def split_into_chunks(text: str, chunk_size: int=CHUNK_SIZE, overlap: int=CHUNK_OVERLAP) -> list:
+    words=[match.span() for match in re.finditer(r"\S+", text)]
+    chunks=[]
+    for start in range(0, len(words), chunk_size-overlap):
+        end=min(start+chunk_size, len(words))
+        chunks.append(text[words[start][0]:words[end-1][1]])
+        if end == len(words):
+            break
+    return chunks
+
+# Quantize unit-length rows to int8 with one symmetric scale per row, a quarter of the float32 size; returns (int8 rows, float32 scales)
+def quantize_int8(vectors: np.ndarray):
+    scales=np.abs(vectors).max(axis=1)/127
+    scales[scales == 0]=1
+    return np.round(vectors/scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+def dequantize_int8(quantized) -> np.ndarray:
+    vectors, scales=quantized
+    return vectors.astype(np.float32)*scales[:, None]
+
+# Approximate cosine similarity of every quantized row with a unit-length query. Rows are widened to float32 a block at a time,
+# so scoring never holds a full float32 copy of the matrix
+def int8_scores(quantized, query_vector: np.ndarray, block_rows: int=4096) -> np.ndarray:
+    vectors, scales=quantized
+    scores=np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), block_rows):
+        block=slice(start, start+block_rows)
+        scores[block]=(vectors[block].astype(np.float32) @ query_vector)*scales[block]
+    return scores
+
+# Disk cache shared by every worker process; None when diskcache is not installed, so only the in-memory caches are used
+@st.cache_resource(show_spinner=False)
+def _disk_cache():
+    try:
+        import diskcache
+
+    except ImportError:
+        return None
+    return diskcache.Cache(DISK_CACHE_DIR, size_limit=DISK_CACHE_SIZE_LIMIT)
+
+# Chunk embeddings cached on the document id and a digest of its chunks, so the same upload is only embedded once across reruns and
+# sessions. The digest covers whatever produced the text (file extension, parser backend, library version), which doc_id alone does not.
+# Stored as int8, and backed by the disk cache so a restarted server doesn't pay for embedding documents again
+@st.cache_data(show_spinner=False, max_entries=INDEX_CACHE_MAX_ENTRIES, ttl=INDEX_CACHE_TTL)
+def _embed_chunks(doc_id: str, chunks_digest: str, _chunks: list, _gemini_api: "GeminiAPI"):
+    disk=_disk_cache()
+    key=("chunk_embeddings", doc_id, chunks_digest, EMBEDDING_MODEL, EMBEDDING_DIM)
+    embeddings=disk.get(key) if disk is not None else None
+    if embeddings is None or len(embeddings[0]) != len(_chunks):
+        embeddings=quantize_int8(_gemini_api.batch_embed(_chunks))
+        if disk is not None:
+            disk.set(key, embeddings)
+    return embeddings
+
+# HNSW index over the chunk embeddings of very large documents, shared across sessions. None below HNSW_MIN_CHUNKS, where scoring
+# every chunk is fast enough and exact, or when hnswlib is not installed
+@st.cache_resource(show_spinner=False, max_entries=INDEX_CACHE_MAX_ENTRIES, ttl=INDEX_CACHE_TTL)
+def _build_hnsw_index(doc_id: str, chunks_digest: str, _embeddings):
+    if len(_embeddings[0]) < HNSW_MIN_CHUNKS:
+        return None
+    try:
+        import hnswlib
+
+    except ImportError:
+        return None
+    vectors=dequantize_int8(_embeddings) # hnswlib only stores float32
+    index=hnswlib.Index(space='cosine', dim=EMBEDDING_DIM)
+    index.init_index(max_elements=len(vectors), ef_construction=200, M=16)
+    index.add_items(vectors, np.arange(len(vectors)))
+    index.set_ef(50) # Must stay >= TOP_K
+    return index
+
+# Chunk and embed a document for retrieval; returns (chunks, int8 embeddings and scales, HNSW index or None).
+# Embeddings are None when the document is small enough to send whole or indexing fails
+def build_chunk_index(text: str, doc_id: str):
+    chunks=split_into_chunks(text)
+    if len(chunks) <= TOP_K:
+        return chunks, None, None
+    try:
+        chunks_digest=hashlib.sha256("\0".join(chunks).encode('utf-8')).hexdigest()
+        embeddings=_embed_chunks(doc_id, chunks_digest, chunks, gemini_api)
+        if len(embeddings[0]) != len(chunks):
+            embeddings=quantize_int8(gemini_api.batch_embed(chunks)) # Cached rows don't line up with these chunks; never retrieve with them
+        return chunks, embeddings, _build_hnsw_index(doc_id, chunks_digest, embeddings)
+
+    except Exception as e:
+        st.warning(f"Could not index the document, it will be sent whole instead: {e}")
+        return chunks, None, None
+
+# Return the TOP_K chunks most similar to the question, best first
+def retrieve_chunks(query_vector: np.ndarray, chunks: list, embeddings, index=None, k: int=TOP_K) -> list:
+    if index is not None:
+        labels, _=index.knn_query(query_vector, k=k) # Sorted by distance, nearest first
+        return [chunks[i] for i in labels[0]]
+    scores=int8_scores(embeddings, query_vector)
+    top=np.argpartition(scores, -k)[-k:]
+    top=top[np.argsort(scores[top])[::-1]]
+    return [chunks[i] for i in top]
+
+# Answer a question on the background event loop; returns (query embedding, response, whether it came from the semantic cache). Everything it needs from
+# st.session_state is passed in, since session state is only reachable from the script thread. pending_embedding is a prefetched
+# embedding of this exact prompt, awaited instead of embedding it again unless the prefetch failed
+async def answer_question(prompt: str, doc_id: str, document: str, chunks: list, embeddings, index, cache_name: Optional[str], cached_vectors: np.ndarray, cached_responses: list, pending_embedding=None, on_text=None):
+    async def embed_query():
+        if pending_embedding is not None and not pending_embedding.cancelled(): # Awaiting a cancelled future would raise CancelledError
+            query_vector=await asyncio.wrap_future(pending_embedding)
+            if query_vector is not None:
+                return query_vector
+        return await gemini_api.aembed(prompt)
+
+    def generate(contents: str, cached_content: Optional[str]=None):
+        return gemini_api.agenerate_response(model=MODEL_NAME, content=contents, system_instruction=SYSTEM_INSTRUCTION, doc_id=doc_id, prompt=prompt, cached_content=cached_content, on_text=on_text)
+
+    if embeddings is not None:
+        # Retrieval needs the question embedding, so the embedding has to finish before generation can start. Once it has, ranking
+        # is one local pass that yields the top chunk and the top TOP_K together, so starting generation on the top chunk first would
+        # save nothing and answer from less context
+        query_vector=await embed_query()
+        response=semantic_cache_lookup(query_vector, cached_vectors, cached_responses)
+        if response is not None:
+            return query_vector, response, True
+        if query_vector is not None:
+            excerpts="\n\n---\n\n".join(retrieve_chunks(query_vector, chunks, embeddings, index))
+            return query_vector, await generate(f"Document Excerpts:\n{excerpts}\n\nQuestion: {prompt}"), False # Only the most relevant chunks, not the whole document
+        return query_vector, await generate(f"Document Content:\n{document}\n\nQuestion: {prompt}"), False
+
+    # The whole document is sent, so generation doesn't depend on the embedding: start both and drop the answer if the semantic cache hits
+    if cache_name:
+        generation=asyncio.ensure_future(generate(f"Question: {prompt}", cache_name)) # Document is already in the context cache
+    else:
+        generation=asyncio.ensure_future(generate(f"Document Content:\n{document}\n\nQuestion: {prompt}"))
+    query_vector=await embed_query()
+    response=semantic_cache_lookup(query_vector, cached_vectors, cached_responses)
+    if response is not None:
+        generation.cancel()
+        return query_vector, response, True
+    return query_vector, await generation, False
+
 
 #Streamlit App UI
 st.set_page_config(page_title="RAG with Google Gemini", layout="wide")
@@ -94,21 +435,50 @@ if 'document_content' not in st.session_state:
 if 'rag_response' not in st.session_state:
     st.session_state.rag_response={"prompt":"","response":""}
 
+#Semantic cache of question embeddings and responses for the current document
+if 'semantic_cache_responses' not in st.session_state:
+    reset_semantic_cache()
+
+#Document chunks, their embeddings and search index (None when the whole document is sent instead)
+if 'doc_embeddings' not in st.session_state:
+    st.session_state.doc_chunks=[]
+    st.session_state.doc_embeddings=None
+    st.session_state.doc_index=None
+
+#Initialize Gemini API handler
+gemini_api=GeminiAPI(api_key=GEMINI_API_KEY)
+
 #Initialize the Gemini API for text area
-if 'user_pprompt_input' not in st.session_state:
+if 'user_prompt_input' not in st.session_state:
     st.session_state.user_prompt_input=""
 
 # 1. Browse and upload document button to load data source
 uploaded_file=st.file_uploader("Upload a document(TXT, MD, PDF, DOCX)", type=['txt', 'md', 'pdf', 'docx'],help="Upload a document that the LLM will reference in its response.")
 if uploaded_file is not None:
-    file_contents=read_document_content(uploaded_file)
+    # Hash the upload once; the digest identifies the document for every cache below, whatever its filename
+    if st.session_state.get('doc_file_id') != uploaded_file.file_id:
+        st.session_state.doc_file_id=uploaded_file.file_id
+        st.session_state.doc_id=hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    doc_id=st.session_state.doc_id
+    file_contents=read_document_content(uploaded_file, doc_id)
     
     if file_contents.startswith("Error reading document:"):
         st.error(file_contents)
         st.session_state.document_content=""
         st.stop()
     else:
+        if st.session_state.get('indexed_doc_id') != doc_id:
+            reset_semantic_cache() # Cached answers belong to the previous document
+            with st.spinner("Indexing document..."):
+                st.session_state.doc_chunks, st.session_state.doc_embeddings, st.session_state.doc_index=build_chunk_index(file_contents, doc_id)
+            st.session_state.indexed_doc_id=doc_id
         st.session_state.document_content=file_contents
+
+        # Look up (or create) the shared Gemini context cache for this document. Only needed when the whole document is sent
+        st.session_state.gemini_cache_name=None
+        if st.session_state.doc_embeddings is None:
+            with st.spinner("Preparing document..."):
+                st.session_state.gemini_cache_name=_context_cache_name(doc_id, MODEL_NAME, file_contents, gemini_api)
         st.success(f"Document '{uploaded_file.name}' uploaded successfully!")
 
         # Display a preview of the document content
@@ -120,12 +490,26 @@ if not st.session_state.document_content:
     st.info("Please upload a document to proceed.")
     st.stop()
 
+# A finished prefetch whose embedding failed or was cancelled; it is dropped so the question is embedded again rather than failing on every click
+def _prefetch_failed(future) -> bool:
+    return future.done() and (future.cancelled() or future.exception() is not None or future.result() is None)
+
+# Start embedding the question in the background once the text box commits it (blur or Ctrl+Enter), so clicking
+# Generate doesn't wait for the embedding. Debounced, and skipped when this exact text is already being embedded
+def prefetch_query_embedding():
+    text=st.session_state.user_prompt_input.strip()
+    pending=st.session_state.get('pending_embedding')
+    if not text or (pending and pending[0] == text and not _prefetch_failed(pending[1])):
+        return
+    now=time.monotonic()
+    if now-st.session_state.get('pending_embedding_at', 0.0) < EMBED_DEBOUNCE_SECONDS:
+        return # Generate embeds the question itself if the prefetched text no longer matches
+    st.session_state.pending_embedding=(text, asyncio.run_coroutine_threadsafe(gemini_api.aembed(text), _event_loop()))
+    st.session_state.pending_embedding_at=now
+
 # 2. Text area for user prompt input
 st.subheader("Ask a question based on the uploaded document")
-st.text_area("Enter your question here:", key='user_prompt_input', placeholder="e.g., What is the main topic of the document?", height=100, help="Type your question that you want the LLM to answer based on the document content.")
-
-#Initialize Gemini API handler
-gemini_api=GeminiAPI(api_key=GEMINI_API_KEY)
+st.text_area("Enter your question here:", key='user_prompt_input', placeholder="e.g., What is the main topic of the document?", height=100, help="Type your question that you want the LLM to answer based on the document content.", on_change=prefetch_query_embedding)
 
 # 3. Generate RAG response button
 def run_rag():
@@ -141,19 +525,33 @@ def run_rag():
     st.session_state.rag_response={"prompt":current_prompt,"response":None}
     
     with st.spinner("Generating response..."):
+        placeholder=st.empty() # Streamed tokens appear here until the full answer is rendered below
+        state=st.session_state
+        pending=state.get('pending_embedding')
+        pending_embedding=pending[1] if pending and pending[0] == current_prompt else None # Only reuse an embedding of this exact question
+        try:
+            query_vector, response, from_cache=run_streaming(lambda on_text: answer_question(current_prompt, state.doc_id, state.document_content, state.doc_chunks, state.doc_embeddings, state.doc_index, state.get('gemini_cache_name'), state.semantic_cache_vectors, state.semantic_cache_responses, pending_embedding, on_text), placeholder)
+
+        except Exception as e:
+            query_vector, response, from_cache=None, f"Unexpected Error: {e}", False # Shown like the errors agenerate_response returns
+        if pending_embedding is not None and _prefetch_failed(pending_embedding):
+            del state.pending_embedding
+        if response.startswith(("API Error:", "Unexpected Error:")):
+            st.error(response)
+        elif query_vector is not None and not from_cache and response != NO_RESPONSE:
+            semantic_cache_add(query_vector, response)
         
-        system_instruction="You are an AI assistant that answers questions based solely on the provided document content. If the answer is not present in the document, respond with 'The information is not available in the document.'"
-        contents_payload=f"Document Content:\n{st.session_state.document_content}\n\nQuestion: {current_prompt}"
-        response=gemini_api.generate_response(model=MODEL_NAME, content=contents_payload, system_instruction=system_instruction)
-        
+        placeholder.empty()
         st.session_state.rag_response["response"]=response
         st.success("Response generated successfully!")
 
-# Button to trigger RAG response generation
-st.button("Generate RAG Response", on_click=run_rag, type="primary")
+# Button to trigger RAG response generation. Generation runs inline (not as an on_click callback) so it can stream into the response section
+generate_clicked=st.button("Generate RAG Response", type="primary")
 
 # 4. Output box for populating the RAG response
 st.subheader("RAG Response")
+if generate_clicked:
+    run_rag()
 if st.session_state.get('rag_response') and st.session_state['rag_response'].get("response"):
     st.markdown("---")
     st.markdown(f"**Question:** {st.session_state['rag_response']['prompt']}")